@@ -4,13 +4,42 @@ from datetime import datetime
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import json
+import time
+import bisect
+import hmac
+import hashlib
+
+# How long (in seconds) we keep using our copy of the data before checking
+# the sheet again for changes made by other people
+DATA_TTL = 60
+
+# The sheet has two tabs: one row per buddy, and one row per session
+BUDDIES_HEADER = ["name"]
+SESSIONS_HEADER = ["date", "month", "total_cost", "attendees", "cost_per_person"]
+
+# What Google access the app asks for
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+# Usual court price, filled in for new sessions
+DEFAULT_COST = 13.10
+
+# Column names for the report tables
+SUMMARY_COLUMNS = ("Games", "Owes (€)")
+HISTORY_COLUMNS = ("Date", "Total Cost (€)", "Cost/Person (€)", "Attendees")
+
+# The passwords are not kept in the code. Instead the Streamlit secrets hold their
+# SHA-256 hashes as "admin_hash" and "report_hash". Make one with:
+#   python -c "import hashlib; print(hashlib.sha256(b'your-password').hexdigest())"
+PASSWORD_HASH_KEYS = {"Admin": "admin_hash", "Reporting User": "report_hash"}
 
 # --- PART 1: SETUP (Google Sheets Connection) ---
 # We use the "Secrets" we saved in Streamlit Cloud
 # This function connects to the sheet safely.
+# It is cached, so the login + sheet lookup only happens once per server process
+# instead of on every click.
+@st.cache_resource
 def get_db():
     # 1. Access the secrets
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
     try:
         creds_dict = dict(st.secrets["gcp_service_account"]) # Reads the secret you saved
     except Exception as e:
@@ -19,70 +48,277 @@ def get_db():
 
     # 2. Create the connection
     try:
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
         client = gspread.authorize(creds)
     except Exception as e:
         st.error("Failed to authorize Google Sheets client. Check your credentials.")
         st.stop()
 
+    # Ask Google to gzip its replies so the sheet data downloads faster.
+    # Google only compresses when the user agent mentions "gzip".
+    client.http_client.session.headers["User-Agent"] = "badminton-buddies (gzip)"
+
    
     # 3. Open the sheet
     # Make sure your Google Sheet is named EXACTLY "Badminton DB"
     try:
-        sheet = client.open("Badminton DB").sheet1 
+        book = client.open("Badminton DB")
     except Exception as e:
         st.error("Could not find the Google Sheet named 'Badminton DB'. Please create it and share access with the bot email.")
         st.stop()
 
-    return sheet
+    # 4. Find the "buddies" and "sessions" tabs (created on first run)
+    existing = {ws.title: ws for ws in book.worksheets()}
+    buddies_ws = open_tab(book, existing, "buddies", BUDDIES_HEADER,
+                          lambda old_data: [[name] for name in old_data["buddies"]])
+    sessions_ws = open_tab(book, existing, "sessions", SESSIONS_HEADER,
+                           lambda old_data: [session_to_row(s) for s in old_data["sessions"]])
+
+    return buddies_ws, sessions_ws
+
+# Find a tab, creating it if needed. A tab without a header row is filled in
+# (header + anything from the old data), so each tab is checked on its own and
+# a first run that stopped half-way gets finished the next time.
+def open_tab(book, existing, title, header, old_rows):
+    ws = existing.get(title)
+    if ws is None:
+        ws = book.add_worksheet(title, rows=100, cols=len(header))
+    if not ws.row_values(1):
+        append_rows(ws, [header] + old_rows(read_old_blob(book)))
+    return ws
+
+# Older versions of the app kept everything as one JSON text in Cell A1 of the
+# first tab. We read it once, to copy that data into the new tabs.
+def read_old_blob(book):
+    old_data = {"buddies": [], "sessions": []}
+    cells = book.sheet1.get('A1', value_render_option='UNFORMATTED_VALUE')
+    raw_data = cells[0][0] if cells and cells[0] else None
+    # The cell may hold a number (or nothing) instead of text, so check before parsing
+    if isinstance(raw_data, str) and raw_data.startswith("{"):
+        old_data = json.loads(raw_data)
+    return old_data
+
+# Helper to talk to the sheet.
+# If the cached connection has expired (Google answers 401), reconnect once and try again.
+# Other errors, like rate limits or server hiccups, are not retried: an "append"
+# may already have gone through, and trying again would add the row twice.
+def use_sheet(action):
+    try:
+        return action(*get_db())
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code != 401:
+            raise
+        get_db.clear()
+        return action(*get_db())
+
+# A session is stored as one row; the attendees go in one cell as "Paul|René|..."
+def session_to_row(session):
+    return [
+        session["date"],
+        session["month"],
+        session["total_cost"],
+        "|".join(session["attendees"]),
+        session["cost_per_person"]
+    ]
 
 # Helper to read data safely
+# The result is shared between visitors for 30 seconds, so several people
+# using the app at once don't each hit the Google Sheets rate limit.
+@st.cache_data(ttl=30, show_spinner=False)
 def load_data():
-    sheet = get_db()
-    # We expect the data in the first cell as a giant text blob (simplest way to migrate)
-    # Ideally, we would use rows/cols, but to keep your code logic same, 
-    # we will store the JSON string in Cell A1.
-    
+    # Read both tabs in a single request (row 1 of each tab is the header).
+    # Errors are not caught here: Streamlit doesn't cache a failed call, so the
+    # next click tries again instead of everyone seeing an empty list.
+    result = use_sheet(lambda buddies_ws, sessions_ws: sessions_ws.spreadsheet.values_batch_get(
+        ranges=["buddies!A2:A", "sessions!A2:E"],
+        params={"valueRenderOption": "UNFORMATTED_VALUE"}
+    ))
+    buddy_rows, session_rows = [r.get("values", []) for r in result["valueRanges"]]
+
+    buddies = [str(row[0]) for row in buddy_rows if row and row[0] != ""]
+
+    # Only one session per date: if the sheet has the same date twice,
+    # the lower (most recently added) row wins
+    sessions_by_date = {}
+    # The first session is on row 2, just under the header
+    for row_number, row in enumerate(session_rows, start=2):
+        if len(row) < len(SESSIONS_HEADER) or not row[0]:
+            continue
+        date, month, total_cost, attendees, cost_per_person = row
+        attendees = str(attendees).split("|")
+        sessions_by_date[str(date)] = {
+            "date": str(date),
+            "month": str(month),
+            "total_cost": float(total_cost),
+            "attendees": attendees,
+            "cost_per_person": float(cost_per_person),
+            "_row": row_number,  # Remember where it lives so we can edit it later
+            "_att_set": set(attendees)  # For instant "did they play?" checks
+        }
+
+    sessions = sorted(sessions_by_date.values(), key=lambda x: x['date'])
+    return {"buddies": buddies, "sessions": sessions}
+
+# After writing to the sheet, keep our copy as the latest version
+def remember_saved(data):
+    # Throw away the shared copy so the next read sees this change
+    load_data.clear()
+    # Our copy is now the latest version, so keep using it
+    st.session_state.data = data
+    st.session_state.data_loaded_at = time.time()
+
+# Helpers to save data
+# Each change only writes the one row it touches, instead of the whole database.
+# New rows are added with "append", which Google Sheets handles safely even when
+# two people save at the same moment (nobody's row gets overwritten).
+def append_rows(ws, rows):
+    return ws.append_rows(
+        rows,
+        value_input_option="RAW",
+        insert_data_option="INSERT_ROWS",
+        table_range="A1"
+    )
+
+# Returns False if someone else already added this name (our copy may be a minute old)
+def add_buddy_row(data, name):
+    def add(buddies_ws, sessions_ws):
+        # Skip the header in row 1, in case someone is called "name"
+        if name in buddies_ws.col_values(1)[1:]:
+            return False
+        append_rows(buddies_ws, [[name]])
+        return True
+    added = use_sheet(add)
+    remember_saved(data)
+    return added
+
+def delete_buddy_row(data, name):
+    def delete(buddies_ws, sessions_ws):
+        # Skip the header in row 1, in case someone is called "name"
+        names = buddies_ws.col_values(1)
+        if name in names[1:]:
+            buddies_ws.delete_rows(names.index(name, 1) + 1)
+    use_sheet(delete)
+    remember_saved(data)
+
+def save_session_row(data, session):
+    row_values = session_to_row(session)
+
+    def update_row(sessions_ws, row):
+        sessions_ws.update(
+            range_name=f"A{row}:E{row}",
+            values=[row_values],
+            value_input_option="RAW"
+        )
+        return row
+
+    def add_or_update(buddies_ws, sessions_ws):
+        # Our copy may be a minute old, so someone else may have saved this date
+        # in the meantime. If so, update their row instead of adding a second one
+        # (the lowest row for a date is the one load_data keeps).
+        dates = sessions_ws.col_values(1)
+        rows_for_date = [i + 1 for i, d in enumerate(dates) if i > 0 and d == session["date"]]
+        if rows_for_date:
+            return update_row(sessions_ws, rows_for_date[-1])
+        result = append_rows(sessions_ws, [row_values])
+        # The reply tells us where it went, e.g. "sessions!A7:E7"
+        first_cell = result["updates"]["updatedRange"].split("!")[-1].split(":")[0]
+        return gspread.utils.a1_to_rowcol(first_cell)[0]
+
+    if "_row" in session:
+        # Editing: overwrite just the session's own row
+        use_sheet(lambda buddies_ws, sessions_ws: update_row(sessions_ws, session["_row"]))
+    else:
+        # New session: add a row at the bottom (unless the date is already there)
+        session["_row"] = use_sheet(add_or_update)
+    remember_saved(data)
+
+# Work out the monthly reports for every month in one go.
+# The result is cached, so switching months in the report doesn't
+# go through the whole history again.
+# Each session comes in as a (date, month, total_cost, attendees, cost_per_person) tuple.
+@st.cache_data(show_spinner=False)
+def build_reports(sessions_tuple):
+    games_col, owes_col = SUMMARY_COLUMNS
+    sessions_df = pd.DataFrame(list(sessions_tuple), columns=SESSIONS_HEADER)
+    # One row per player per session, so pandas can add up games and costs for us
+    played = sessions_df.explode("attendees").rename(columns={"attendees": "player"})
+    played_by_month = dict(tuple(played.groupby("month")))
+
+    by_month = {}
+    for month, month_sessions in sessions_df.groupby("month"):
+        players = (
+            played_by_month[month].groupby("player", sort=False)
+            .agg(**{games_col: ("player", "size"), owes_col: ("cost_per_person", "sum")})
+            .rename_axis(None)
+            .round(2)
+        )
+
+        history = month_sessions[["date", "total_cost", "cost_per_person", "attendees"]].copy()
+        history["cost_per_person"] = history["cost_per_person"].round(2)
+        history["attendees"] = history["attendees"].str.join(", ")
+        history.columns = HISTORY_COLUMNS
+
+        by_month[month] = {
+            "players": players,
+            "total": float(month_sessions["total_cost"].sum()),
+            "history": history.reset_index(drop=True)
+        }
+
+    # The months that have sessions, newest first, for the report's month picker.
+    # This is cached along with the reports, keyed on the full session list.
+    return {"months": tuple(sorted(by_month, reverse=True)), "by_month": by_month}
+
+# Check a password against the hash saved in the secrets for that role
+def password_matches(role, password):
     try:
-        raw_data = sheet.acell('A1').value
-        if not raw_data:
-            # If empty, return default structure
-            return {"buddies": [], "sessions": []}
-        return json.loads(raw_data)
+        expected = bytes.fromhex(st.secrets[PASSWORD_HASH_KEYS[role]])
     except Exception as e:
-        return {"buddies": [], "sessions": []}
-
-# Helper to save data
-def save_data(data):
-    sheet = get_db()
-    # Convert our data back to text and save in Cell A1
-    json_str = json.dumps(data, ensure_ascii=False)
-    sheet.update_acell('A1', json_str)
+        st.sidebar.error("Password hash not found. Please set up the secrets correctly.")
+        st.stop()
+    # compare_digest takes the same time whether or not the start of the password matches
+    return hmac.compare_digest(hashlib.sha256(password.encode()).digest(), expected)
 
-# Load data once at the start
+# Load data once per visitor and keep it in the session,
+# so clicking around the page doesn't re-read the sheet every time
 try:
-    data = load_data()
+    if "data" not in st.session_state or time.time() - st.session_state.get("data_loaded_at", 0) > DATA_TTL:
+        st.session_state.data = load_data()
+        st.session_state.data_loaded_at = time.time()
+        # Look up sessions by date without searching the whole list
+        st.session_state.sessions_by_date = {s["date"]: s for s in st.session_state.data["sessions"]}
+        # The sessions are sorted by date, so keeping the dates in a list
+        # lets us find where a new session goes without re-sorting
+        st.session_state.session_dates = [s["date"] for s in st.session_state.data["sessions"]]
+    data = st.session_state.data
+    sessions_by_date = st.session_state.sessions_by_date
+    session_dates = st.session_state.session_dates
 except Exception as e:
     st.error("Could not connect to Google Sheet. Did you share 'Badminton DB' with the bot email?")
     st.stop()
 
+# A set makes "is this name in the list?" checks instant, however long the list gets
+buddies_set = set(data["buddies"])
+
 # --- PART 2: THE SIDEBAR (Login) ---
 st.title("🏸 Badminton Buddies")
 
 user_role = st.sidebar.selectbox("Login As:", ["Guest", "Admin", "Reporting User"])
-password = ""
 
-if user_role in ["Admin", "Reporting User"]:
-    password = st.sidebar.text_input("Password", type="password")
-
-# Check password
+# Check password (only once per visit; after that we remember the login)
 authorized = False
-if user_role == "Admin" and password == "admin123":
-    authorized = True
-elif user_role == "Reporting User" and password == "report123":
-    authorized = True
-elif user_role != "Guest":
-    st.sidebar.error("Wrong password")
+if user_role != "Guest":
+    if st.session_state.get("authorized_role") == user_role:
+        authorized = True
+        if st.sidebar.button("Log out"):
+            del st.session_state.authorized_role
+            st.rerun()
+    else:
+        password = st.sidebar.text_input("Password", type="password")
+        if password_matches(user_role, password):
+            st.session_state.authorized_role = user_role
+            st.rerun()
+        else:
+            st.sidebar.error("Wrong password")
 
 # --- PART 3: ADMIN AREA (Record/Edit) ---
 if user_role == "Admin" and authorized:
@@ -96,29 +332,32 @@ if user_role == "Admin" and authorized:
         if st.button("Add Buddy"):
             if not new_buddy:
                 st.error("Name cannot be empty.")
-            elif new_buddy in data["buddies"]:
+            elif "|" in new_buddy:
+                st.error("Name cannot contain '|'.")
+            elif new_buddy in buddies_set:
                 st.error(f"⚠️ '{new_buddy}' is already in the list!")
             else:
+                added = add_buddy_row(data, new_buddy)
+                # Either way the name is now in the sheet, so add it to our copy too
                 data["buddies"].append(new_buddy)
-                save_data(data)
-                st.success(f"Added {new_buddy}!")
+                if added:
+                    st.success(f"Added {new_buddy}!")
+                else:
+                    st.error(f"⚠️ '{new_buddy}' is already in the list!")
         
         st.write("---")
         st.write("### Remove Buddy")
         buddy_to_remove = st.selectbox("Select Buddy to Remove", ["Select..."] + data["buddies"])
         
         if buddy_to_remove != "Select...":
-            games_played = 0
-            for s in data["sessions"]:
-                if buddy_to_remove in s["attendees"]:
-                    games_played += 1
+            games_played = sum(1 for s in data["sessions"] if buddy_to_remove in s["_att_set"])
             
             if games_played > 0:
                 st.warning(f"⚠️ Warning: {buddy_to_remove} is recorded in {games_played} past sessions.")
             
             if st.button(f"Confirm Delete '{buddy_to_remove}'"):
+                delete_buddy_row(data, buddy_to_remove)
                 data["buddies"].remove(buddy_to_remove)
-                save_data(data)
                 st.success(f"Removed {buddy_to_remove}")
                 st.rerun()
 
@@ -128,9 +367,14 @@ if user_role == "Admin" and authorized:
     st.subheader("Record / Edit Session")
     
     session_date = st.date_input("Select Date", datetime.today())
-    date_str = str(session_date)
+    # Work out the date texts once per picked date and remember them
+    date_texts = st.session_state.setdefault("date_texts", {})
+    day = session_date.toordinal()
+    if day not in date_texts:
+        date_texts[day] = (session_date.isoformat(), f"{session_date.year:04d}-{session_date.month:02d}")
+    date_str, month_str = date_texts[day]
 
-    existing_session = next((s for s in data["sessions"] if s["date"] == date_str), None)
+    existing_session = sessions_by_date.get(date_str)
 
     if existing_session:
         st.info(f"📅 Editing record for {date_str}.")
@@ -139,43 +383,53 @@ if user_role == "Admin" and authorized:
         button_label = "Update Session"
     else:
         st.write(f"🆕 Creating NEW session for {date_str}.")
-        default_cost = 13.10
+        default_cost = DEFAULT_COST
         default_attendees = []
         button_label = "Save Session"
 
-    court_cost = st.number_input("Court Cost (€)", value=default_cost, step=0.5)
-    
-    st.write("Who played?")
-    attendees = []
-    
-    cols = st.columns(2)
-    for index, buddy in enumerate(data["buddies"]):
-        is_checked = buddy in default_attendees
-        unique_key = f"{date_str}_{buddy}"
+    # The form only sends the choices when the button is pressed,
+    # so ticking boxes doesn't reload the page each time
+    with st.form("session_form"):
+        court_cost = st.number_input("Court Cost (€)", value=default_cost, step=0.5)
         
-        with cols[index % 2]:
-            if st.checkbox(buddy, key=unique_key, value=is_checked):
-                attendees.append(buddy)
-            
-    if st.button(button_label):
-        if len(attendees) > 0:
-            if existing_session:
-                data["sessions"].remove(existing_session)
+        # Buddies who were removed from the list can't be picked any more
+        default_set = frozenset(default_attendees)
+        attendees = st.multiselect(
+            "Who played?",
+            options=data["buddies"],
+            default=[buddy for buddy in data["buddies"] if buddy in default_set],
+            key=f"att_{date_str}"
+        )
+                
+        submitted = st.form_submit_button(button_label)
 
+    if submitted:
+        if len(attendees) > 0:
             cost_per_person = court_cost / len(attendees)
             
             new_session = {
                 "date": date_str,
-                "month": session_date.strftime("%Y-%m"),
+                "month": month_str,
                 "total_cost": court_cost,
                 "attendees": attendees,
-                "cost_per_person": cost_per_person
+                "cost_per_person": cost_per_person,
+                "_att_set": set(attendees)
             }
-            
-            data["sessions"].append(new_session)
-            data["sessions"] = sorted(data["sessions"], key=lambda x: x['date'])
-            
-            save_data(data)
+            if existing_session:
+                # Same date, so the updated session keeps the old one's sheet row
+                new_session["_row"] = existing_session["_row"]
+
+            # Write to the sheet first, so our copy only changes once the save worked
+            save_session_row(data, new_session)
+
+            pos = bisect.bisect_left(session_dates, date_str)
+            if existing_session:
+                # ...and takes the old one's place in the list
+                data["sessions"][pos] = new_session
+            else:
+                session_dates.insert(pos, date_str)
+                data["sessions"].insert(pos, new_session)
+            sessions_by_date[date_str] = new_session
             st.success(f"Session for {date_str} saved to Google Sheets!")
             st.rerun()
         else:
@@ -186,45 +440,29 @@ if (user_role == "Reporting User" or user_role == "Admin") and authorized:
     st.write("---")
     st.header("💰 Cost Reports")
     
-    available_months = sorted(list(set(s['month'] for s in data['sessions'])), reverse=True)
+    reports = build_reports(tuple(
+        (s['date'], s['month'], s['total_cost'], tuple(s['attendees']), s['cost_per_person'])
+        for s in data['sessions']
+    ))
+    available_months = reports["months"]
     
     if not available_months:
         st.info("No games played yet.")
     else:
         selected_month = st.selectbox("Select Month", available_months)
-        month_sessions = [s for s in data['sessions'] if s['month'] == selected_month]
+        month_report = reports["by_month"].get(selected_month)
         
-        if month_sessions:
+        if month_report:
             st.subheader(f"Summary for {selected_month}")
-            report_card = {}
-            
-            for session in month_sessions:
-                for player in session['attendees']:
-                    if player not in report_card:
-                        report_card[player] = {"Games": 0, "Owes (€)": 0.0}
-                    report_card[player]["Games"] += 1
-                    report_card[player]["Owes (€)"] += session['cost_per_person']
             
-            df_summary = pd.DataFrame.from_dict(report_card, orient='index')
-            df_summary = df_summary.round(2)
-            st.table(df_summary)
+            st.table(month_report["players"])
             
-            total_month_cost = sum(s['total_cost'] for s in month_sessions)
+            total_month_cost = month_report["total"]
             st.caption(f"Total Court Fees Paid this month: {total_month_cost}€")
 
             st.write("---")
             with st.expander("View Detailed Session History", expanded=False):
-                history_data = []
-                for session in month_sessions:
-                    history_data.append({
-                        "Date": session["date"],
-                        "Total Cost (€)": session["total_cost"],
-                        "Cost/Person (€)": round(session["cost_per_person"], 2),
-                        "Attendees": ", ".join(session["attendees"])
-                    })
-                
-                df_history = pd.DataFrame(history_data)
-                st.table(df_history)
+                st.table(month_report["history"])
         else:
             st.warning("No data found for this month.")
 